@@ -1,15 +1,48 @@
 import asyncio
-import json
+import hashlib
 import time
+from contextlib import asynccontextmanager
 import aiohttp
 import logging
-from fastapi import FastAPI, HTTPException, Body
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-# Configuração detalhada do logging para debug
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+# Logging em nível INFO; os dumps de payload só são gerados quando DEBUG estiver habilitado
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Cache das respostas de /paused_campaigns (bytes JSON já serializados), locks por chave e
+# número de requisições usando cada lock (o lock só é descartado quando ninguém mais o aguarda)
+_paused_campaigns_cache = TTLCache(maxsize=1024, ttl=60)
+_paused_campaigns_locks = {}
+_paused_campaigns_lock_refs = {}
+
+# Timeouts por fase (conexão/leitura) e teto por requisição ao Graph API; não há timeout
+# total compartilhado entre a listagem de campanhas e os insights
+GRAPH_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=2, sock_read=5)
+
+# Filtros (JSON constante) de status 'PAUSED' para a listagem de campanhas e para os insights da conta
+_PAUSED_FILTERING = '[{"field":"effective_status","operator":"IN","value":["PAUSED"]}]'
+_PAUSED_INSIGHTS_FILTERING = '[{"field":"campaign.effective_status","operator":"IN","value":["PAUSED"]}]'
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Cria uma única ClientSession compartilhada entre as requisições, reaproveitando
+    as conexões (keep-alive) com graph.facebook.com, e a fecha no shutdown.
+    """
+    connector = aiohttp.TCPConnector(limit=300, limit_per_host=75, ttl_dns_cache=600, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=2, sock_read=5)
+    app.state.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    try:
+        yield
+    finally:
+        await app.state.session.close()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Habilita CORS para todas as origens (ajuste conforme necessário)
 app.add_middleware(
@@ -21,200 +54,198 @@ app.add_middleware(
 )
 
 def format_percentage(value: float) -> str:
-    logging.debug(f"Formatando valor {value} como porcentagem")
-    formatted = f"{value:.2f}%"
-    logging.debug(f"Valor formatado: {formatted}")
-    return formatted
+    return "%.2f%%" % value
 
 def format_currency(value: float) -> str:
-    logging.debug(f"Formatando valor {value} como moeda")
-    formatted = f"{value:.2f}"
-    logging.debug(f"Valor formatado: {formatted}")
-    return formatted
+    return "%.2f" % value
 
-async def fetch_campaign_insights(campaign_id: str, access_token: str, session: aiohttp.ClientSession):
+def _safe_float(d: dict, key: str, default: float = 0.0) -> float:
     """
-    Busca os insights de uma campanha individual usando o endpoint do Meta Ads.
+    Converte d[key] para float, retornando 'default' se a chave estiver ausente ou o valor for inválido.
     """
-    logging.debug(f"[fetch_campaign_insights] INÍCIO para campanha_id: {campaign_id}")
-    campaign_insights_url = f"https://graph.facebook.com/v16.0/{campaign_id}/insights"
-    params_campaign_insights = {
-        "fields": "impressions,clicks,ctr,cpc,spend,actions",
-        "date_preset": "maximum",
-        "access_token": access_token
-    }
-    logging.debug(f"[fetch_campaign_insights] URL: {campaign_insights_url}")
-    logging.debug(f"[fetch_campaign_insights] Params: {params_campaign_insights}")
-    
-    req_start = time.perf_counter()
-    async with session.get(campaign_insights_url, params=params_campaign_insights) as resp:
-        req_end = time.perf_counter()
-        response_time = req_end - req_start
-        logging.debug(f"[fetch_campaign_insights] Requisição concluída em {response_time:.3f} segundos com status {resp.status}")
-        
-        try:
-            response_text = await resp.text()
-            logging.debug(f"[fetch_campaign_insights] Resposta texto: {response_text}")
-        except Exception as e:
-            logging.error(f"[fetch_campaign_insights] Erro ao ler resposta texto para campanha {campaign_id}: {e}")
-            response_text = ""
-            
-        if resp.status != 200:
-            logging.error(f"[fetch_campaign_insights] Erro HTTP {resp.status} para campanha {campaign_id}. Resposta: {response_text}")
-            raise Exception(f"Erro {resp.status}: {response_text}")
-        
-        try:
-            response_json = await resp.json()
-            logging.debug(f"[fetch_campaign_insights] JSON decodificado: {response_json}")
-        except Exception as e:
-            logging.error(f"[fetch_campaign_insights] Erro ao decodificar JSON para campanha {campaign_id}: {e}")
-            raise
-        
-        logging.debug(f"[fetch_campaign_insights] FINALIZANDO para campanha_id: {campaign_id}")
-        return response_json
-
-async def fetch_paused_campaigns(account_id: str, access_token: str):
+    value = d.get(key)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+async def iter_graph_pages(url: str, params: dict, session: aiohttp.ClientSession):
     """
-    Consulta todas as campanhas com status 'PAUSED' para uma determinada conta do Meta Ads.
+    Itera sobre as páginas de uma consulta ao Graph API, seguindo o cursor 'paging.next'.
+    Cada item produzido é a lista 'data' de uma página.
     """
-    logging.debug(f"[fetch_paused_campaigns] INÍCIO - account_id: {account_id}, access_token: {access_token}")
-    timeout = aiohttp.ClientTimeout(total=3)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        campaigns_url = f"https://graph.facebook.com/v16.0/act_{account_id}/campaigns"
-        filtering = json.dumps([{
-            "field": "effective_status",
-            "operator": "IN",
-            "value": ["PAUSED"]
-        }])
-        params_campaigns = {
-            "fields": "id,name,status",
-            "filtering": filtering,
-            "access_token": access_token
-        }
-        
-        logging.debug(f"[fetch_paused_campaigns] Buscando campanhas pausadas com URL: {campaigns_url}")
-        logging.debug(f"[fetch_paused_campaigns] Params campanhas: {params_campaigns}")
+    while url:
         req_start = time.perf_counter()
-        async with session.get(campaigns_url, params=params_campaigns) as resp:
-            req_end = time.perf_counter()
-            response_time = req_end - req_start
-            logging.debug(f"[fetch_paused_campaigns] Requisição de campanhas pausadas completada em {response_time:.3f} segundos com status {resp.status}")
-            
-            try:
-                response_text = await resp.text()
-                logging.debug(f"[fetch_paused_campaigns] Resposta texto campanhas: {response_text}")
-            except Exception as e:
-                logging.error(f"[fetch_paused_campaigns] Erro ao ler resposta de campanhas pausadas: {e}")
-                response_text = ""
-                
+        async with session.get(url, params=params, timeout=GRAPH_REQUEST_TIMEOUT) as resp:
+            logger.debug("[iter_graph_pages] %s: status %s em %.3f segundos",
+                         resp.url.path, resp.status, time.perf_counter() - req_start)
+
             if resp.status != 200:
-                logging.error(f"[fetch_paused_campaigns] Erro ao buscar campanhas pausadas: status {resp.status} - {response_text}")
+                try:
+                    response_text = await resp.text()
+                except Exception as e:
+                    logger.error("[iter_graph_pages] Erro ao ler resposta de %s: %s", resp.url.path, e)
+                    response_text = ""
+                logger.error("[iter_graph_pages] Erro ao consultar %s: status %s - %s", resp.url.path, resp.status, response_text)
                 raise Exception(f"Erro {resp.status}: {response_text}")
-            
+
             try:
-                campaigns_data = await resp.json()
-                logging.debug(f"[fetch_paused_campaigns] JSON recebido de campanhas pausadas: {campaigns_data}")
+                page_data = await resp.json(loads=orjson.loads)
             except Exception as e:
-                logging.error(f"[fetch_paused_campaigns] Erro ao decodificar JSON de campanhas pausadas: {e}")
+                logger.error("[iter_graph_pages] Erro ao decodificar JSON de %s: %s", resp.url.path, e)
                 raise
-        
-        campaigns_list = campaigns_data.get("data", [])
-        logging.debug(f"[fetch_paused_campaigns] Número de campanhas pausadas encontradas: {len(campaigns_list)}")
-        paused_campaigns = []
-        tasks = []
-        
-        for camp in campaigns_list:
-            logging.debug(f"[fetch_paused_campaigns] Agendando insights para campanha: {camp}")
-            tasks.append(fetch_campaign_insights(camp["id"], access_token, session))
-        
-        logging.debug(f"[fetch_paused_campaigns] Iniciando asyncio.gather para insights de {len(tasks)} campanhas")
-        insights_results = await asyncio.gather(*tasks, return_exceptions=True)
-        logging.debug(f"[fetch_paused_campaigns] Resultado do gather: {insights_results}")
-        
-        for idx, camp in enumerate(campaigns_list):
-            logging.debug(f"[fetch_paused_campaigns] Processando dados para campanha index {idx} - ID: {camp.get('id', '')}")
-            campaign_obj = {
-                "id": camp.get("id", ""),
-                "nome_da_campanha": camp.get("name", ""),
-                "cpc": "0.00",
-                "impressions": 0,
-                "clicks": 0,
-                "ctr": "0.00%"
-            }
-            insight = insights_results[idx]
-            if isinstance(insight, Exception):
-                logging.error(f"[fetch_paused_campaigns] Exceção nos insights para campanha {camp.get('id', '')}: {insight}")
-            else:
-                if "data" in insight and insight["data"]:
-                    item = insight["data"][0]
-                    logging.debug(f"[fetch_paused_campaigns] Insights brutos para campanha {camp.get('id', '')}: {item}")
-                    try:
-                        impressions = float(item.get("impressions", 0))
-                        logging.debug(f"[fetch_paused_campaigns] Impressions convertidas: {impressions}")
-                    except Exception as e:
-                        logging.error(f"[fetch_paused_campaigns] Erro convertendo impressions para campanha {camp.get('id', '')}: {e}")
-                        impressions = 0.0
-                    try:
-                        clicks = float(item.get("clicks", 0))
-                        logging.debug(f"[fetch_paused_campaigns] Clicks convertidos: {clicks}")
-                    except Exception as e:
-                        logging.error(f"[fetch_paused_campaigns] Erro convertendo clicks para campanha {camp.get('id', '')}: {e}")
-                        clicks = 0.0
-                    try:
-                        cpc = float(item.get("cpc", 0))
-                        logging.debug(f"[fetch_paused_campaigns] CPC convertido: {cpc}")
-                    except Exception as e:
-                        logging.error(f"[fetch_paused_campaigns] Erro convertendo cpc para campanha {camp.get('id', '')}: {e}")
-                        cpc = 0.0
-                    
-                    ctr_value = (clicks / impressions * 100) if impressions > 0 else 0.0
-                    logging.debug(f"[fetch_paused_campaigns] CTR calculado: {ctr_value}")
-                    
-                    campaign_obj["impressions"] = int(impressions)
-                    campaign_obj["clicks"] = int(clicks)
-                    campaign_obj["ctr"] = format_percentage(ctr_value)
-                    campaign_obj["cpc"] = format_currency(cpc)
-                    logging.debug(f"[fetch_paused_campaigns] Objeto da campanha atualizado: {campaign_obj}")
-                else:
-                    logging.debug(f"[fetch_paused_campaigns] Sem dados de insights para a campanha {camp.get('id', '')}")
-            paused_campaigns.append(campaign_obj)
-        
-        logging.debug(f"[fetch_paused_campaigns] FINALIZANDO. Total de campanhas pausadas processadas: {len(paused_campaigns)}")
-        return paused_campaigns
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[iter_graph_pages] JSON recebido: %s", orjson.dumps(page_data).decode())
+
+        yield page_data.get("data", [])
+
+        # A URL de 'paging.next' já traz todos os parâmetros da consulta, inclusive o cursor
+        url = page_data.get("paging", {}).get("next")
+        params = None
+
+async def fetch_paused_campaigns_list(account_id: str, access_token: str, session: aiohttp.ClientSession) -> list:
+    """
+    Lista todas as campanhas com status 'PAUSED' da conta.
+    """
+    url = f"https://graph.facebook.com/v16.0/act_{account_id}/campaigns"
+    params = {
+        "fields": "id,name,status",
+        "filtering": _PAUSED_FILTERING,
+        "access_token": access_token
+    }
+    return [camp async for page in iter_graph_pages(url, params, session) for camp in page]
+
+async def fetch_paused_campaigns_insights(account_id: str, access_token: str, session: aiohttp.ClientSession) -> dict:
+    """
+    Busca, em uma única consulta no nível da conta (level=campaign), os insights de todas as
+    campanhas pausadas. Retorna um dicionário {campaign_id: linha de insights}; campanhas que
+    nunca tiveram impressões simplesmente não aparecem no resultado.
+    """
+    url = f"https://graph.facebook.com/v16.0/act_{account_id}/insights"
+    params = {
+        "level": "campaign",
+        "fields": "campaign_id,impressions,clicks,cpc",
+        "filtering": _PAUSED_INSIGHTS_FILTERING,
+        "date_preset": "maximum",
+        "access_token": access_token
+    }
+    return {row.get("campaign_id"): row async for page in iter_graph_pages(url, params, session) for row in page}
+
+async def fetch_paused_campaigns(account_id: str, access_token: str, session: aiohttp.ClientSession):
+    """
+    Consulta todas as campanhas com status 'PAUSED' para uma determinada conta do Meta Ads.
+    A listagem das campanhas e a consulta agregada de insights são feitas em paralelo.
+    Retorna (paused_campaigns, insights_ok); se a consulta de insights falhar, as campanhas
+    vêm com métricas zeradas e insights_ok é False.
+    """
+    insights_task = asyncio.create_task(fetch_paused_campaigns_insights(account_id, access_token, session))
+    try:
+        campaigns_list = await fetch_paused_campaigns_list(account_id, access_token, session)
+    except BaseException:
+        # Sem a listagem os insights não servem para nada; cancela em vez de esperar todas as páginas
+        insights_task.cancel()
+        await asyncio.gather(insights_task, return_exceptions=True)
+        raise
+
+    try:
+        insights_by_id = await insights_task
+        insights_ok = True
+    except Exception as e:
+        logger.error("[fetch_paused_campaigns] Exceção nos insights da conta %s: %s", account_id, e)
+        insights_by_id = {}
+        insights_ok = False
+
+    paused_campaigns = []
+    for camp in campaigns_list:
+        impressions = clicks = cpc = 0.0
+        item = insights_by_id.get(camp.get("id"))
+        if item:
+            impressions = _safe_float(item, "impressions")
+            clicks = _safe_float(item, "clicks")
+            cpc = _safe_float(item, "cpc")
+        else:
+            logger.debug("[fetch_paused_campaigns] Sem dados de insights para a campanha %s", camp.get("id", ""))
+
+        ctr_value = (clicks / impressions * 100) if impressions > 0 else 0.0
+        paused_campaigns.append({
+            "id": camp.get("id", ""),
+            "nome_da_campanha": camp.get("name", ""),
+            "cpc": format_currency(cpc),
+            "impressions": int(impressions),
+            "clicks": int(clicks),
+            "ctr": format_percentage(ctr_value)
+        })
+
+    logger.debug("[fetch_paused_campaigns] Total de campanhas pausadas processadas: %d", len(paused_campaigns))
+    return paused_campaigns, insights_ok
+
+async def get_paused_campaigns_payload(account_id: str, access_token: str, session: aiohttp.ClientSession) -> bytes:
+    """
+    Retorna o corpo JSON (já serializado) da resposta de campanhas pausadas, usando um cache
+    TTL por (account_id, hash do access_token). Requisições concorrentes para a mesma chave
+    aguardam a mesma consulta ao Graph API em vez de dispará-la várias vezes.
+    """
+    key = (account_id, hashlib.blake2b(access_token.encode(), digest_size=16).digest())
+    body = _paused_campaigns_cache.get(key)
+    if body is not None:
+        logger.debug("[get_paused_campaigns_payload] Cache hit para conta %s", account_id)
+        return body
+
+    lock = _paused_campaigns_locks.setdefault(key, asyncio.Lock())
+    _paused_campaigns_lock_refs[key] = _paused_campaigns_lock_refs.get(key, 0) + 1
+    try:
+        async with lock:
+            body = _paused_campaigns_cache.get(key)
+            if body is None:
+                paused_campaigns, insights_ok = await fetch_paused_campaigns(account_id, access_token, session)
+                total_paused = len(paused_campaigns)
+                result = {
+                    "paused_campaigns_total": total_paused,
+                    "paused_campaigns": paused_campaigns
+                }
+                logger.info("[get_paused_campaigns_payload] Conta %s: %d campanhas pausadas", account_id, total_paused)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[get_paused_campaigns_payload] Resposta final: %s", orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
+                body = orjson.dumps(result)
+                # Resultados degradados (insights com erro) não são cacheados
+                if insights_ok:
+                    _paused_campaigns_cache[key] = body
+            return body
+    finally:
+        _paused_campaigns_lock_refs[key] -= 1
+        if not _paused_campaigns_lock_refs[key]:
+            del _paused_campaigns_lock_refs[key]
+            del _paused_campaigns_locks[key]
 
 @app.post("/paused_campaigns")
-async def get_paused_campaigns(payload: dict = Body(...)):
+async def get_paused_campaigns(request: Request, payload: dict = Body(...)):
     """
     Endpoint para buscar campanhas pausadas do Meta Ads.
     O body da requisição deve conter 'account_id' e 'access_token'.
     """
-    logging.debug("[endpoint: /paused_campaigns] Requisição recebida com payload:")
-    logging.debug(json.dumps(payload, indent=2, ensure_ascii=False))
-    
     account_id = payload.get("account_id")
     access_token = payload.get("access_token")
-    
+
     if not account_id or not access_token:
-        logging.error("[endpoint: /paused_campaigns] Payload inválido: 'account_id' ou 'access_token' ausentes.")
+        logger.error("[endpoint: /paused_campaigns] Payload inválido: 'account_id' ou 'access_token' ausentes.")
         raise HTTPException(status_code=400, detail="É necessário fornecer 'account_id' e 'access_token' no corpo da requisição.")
-    
-    logging.debug(f"[endpoint: /paused_campaigns] Valores extraídos: account_id={account_id}, access_token={access_token[:10]}...")  # Parciais para segurança
-    
+
+    logger.debug("[endpoint: /paused_campaigns] account_id=%s, access_token=%s...", account_id, access_token[:10])  # Parciais para segurança
+
     try:
-        logging.debug("[endpoint: /paused_campaigns] Chamando fetch_paused_campaigns()")
-        paused_campaigns = await fetch_paused_campaigns(account_id, access_token)
-        total_paused = len(paused_campaigns)
-        result = {
-            "paused_campaigns_total": total_paused,
-            "paused_campaigns": paused_campaigns
-        }
-        logging.info(f"[endpoint: /paused_campaigns] Resposta final: {json.dumps(result, indent=2, ensure_ascii=False)}")
-        return result
+        body = await get_paused_campaigns_payload(account_id, access_token, request.app.state.session)
+        # O corpo já vem serializado pelo orjson (e cacheado); retornar um Response cru evita
+        # o jsonable_encoder e a re-serialização do FastAPI
+        return Response(content=body, media_type="application/json")
     except Exception as e:
-        logging.error("[endpoint: /paused_campaigns] Erro ao processar a requisição", exc_info=True)
+        logger.error("[endpoint: /paused_campaigns] Erro ao processar a requisição", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    logging.info("Iniciando aplicação com uvicorn na porta 8000")
+    logger.info("Iniciando aplicação com uvicorn na porta 8000")
+    # loop="auto" (padrão) já usa o uvloop quando instalado (fora do Windows)
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)